@@ -1,17 +1,21 @@
 import os
 import re
 import asyncio
+import base64
+import quopri
 import aiohttp
 import discord
 from discord.ext import commands
 import imaplib
 import email
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
 import logging
+from collections import defaultdict, deque
 from typing import Optional, Tuple, List
 from contextlib import asynccontextmanager
 import time
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 # Configure logging with debug level and detailed formatting
 logging.basicConfig(
@@ -21,61 +25,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Bot configuration
-bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
 TOKEN = os.getenv("TOKEN")
 EMAIL = str(os.getenv("EMAIL"))
 PASSWORD = str(os.getenv("PASSWORD"))
 SERVER = "imap.gmail.com"
 
+# Short-lived cache of fetched email content so !signin followed by !verify
+# against the same message hits memory instead of another IMAP round trip
+EMAIL_CACHE_TTL = 120  # seconds
+EMAIL_CACHE_MAX_ENTRIES = 256
+
+# Persistent IMAP connection tuning
+IMAP_KEEPALIVE_INTERVAL = 300  # seconds
+# Cap batched FETCH sets; larger sets can exceed server command-size limits
+IMAP_FETCH_BATCH_LIMIT = 100
+# With server-side newest-first ordering only a few candidates need scanning
+IMAP_SORT_CANDIDATE_LIMIT = 5
+# How far back SEARCH looks; codes expire after 15 minutes so one day is plenty
+IMAP_SEARCH_WINDOW_DAYS = 1
 
 # Rate limiting
 RATE_LIMIT_WINDOW = 60  # seconds
 RATE_LIMIT_MAX_REQUESTS = 5
-user_request_times = {}
+RATE_LIMIT_JANITOR_INTERVAL = 300  # seconds
 
-VERIFY_LINK_REGEX = re.compile(
-    r"\[(https://www\.netflix\.com/account/travel/verify[^\]]*)\]"
-)
+# Stop buffering the verification page past this point if no code was found
+VERIFY_MAX_RESPONSE_BYTES = 2 * 1024 * 1024
 
-# Regex pattern for Netflix sign-in codes (typically 6-8 digit codes)
-SIGN_IN_CODE_REGEX = re.compile(
-    r"(?:nhập mã này để đăng nhập|mã đăng nhập|sign.?in code|verification code)[^\d\n]*(\d{4,8})",
-    re.IGNORECASE | re.MULTILINE,
-)
+# Bound for the last-resort digit scan in sign-in-code extraction
+FALLBACK_SEARCH_WINDOW = 2000  # characters
 
 
-def parse_email_date(date_str: str) -> Optional[datetime]:
-    """Parse email date string to datetime object"""
+def parse_email_date(date_str: str) -> Optional[float]:
+    """Parse email date string to a Unix timestamp"""
     try:
         if not date_str:
             return None
 
-        # Common email date formats
-        from email.utils import parsedate_to_datetime
-
+        # Handles the common email date formats
         parsed_date = parsedate_to_datetime(date_str)
-        return parsed_date
+        # Assume UTC for the rare tz-less Date header, then convert once so
+        # the expiry check is plain float arithmetic
+        if parsed_date.tzinfo is None:
+            parsed_date = parsed_date.replace(tzinfo=timezone.utc)
+        return parsed_date.timestamp()
     except Exception as e:
         logger.error(f"Error parsing email date '{date_str}': {e}")
         return None
 
 
 def is_code_expired(
-    email_date: Optional[datetime], expiry_minutes: int = 15
+    email_date_ts: Optional[float], expiry_minutes: int = 15
 ) -> Tuple[bool, str]:
     """Check if sign-in code is expired based on email timestamp"""
     try:
-        if not email_date:
+        if not email_date_ts:
             return True, "Unknown email date"
 
-        now = datetime.now(timezone.utc)
-        # Ensure email_date is timezone aware
-        if email_date.tzinfo is None:
-            email_date = email_date.replace(tzinfo=timezone.utc)
-
-        time_diff = now - email_date
-        minutes_elapsed = time_diff.total_seconds() / 60
+        minutes_elapsed = (time.time() - email_date_ts) / 60
 
         if minutes_elapsed > expiry_minutes:
             return (
@@ -112,520 +119,1057 @@ def decode_email_subject(subject: str) -> str:
         return subject  # Return original if decoding fails
 
 
-def is_rate_limited(user_id: int) -> bool:
-    """Check if user is rate limited"""
-    current_time = time.time()
+def _imap_since_date() -> str:
+    """IMAP-format date bounding SEARCH to the recent window"""
+    since = datetime.now(timezone.utc) - timedelta(days=IMAP_SEARCH_WINDOW_DAYS)
+    return since.strftime("%d-%b-%Y")
 
-    if user_id not in user_request_times:
-        user_request_times[user_id] = []
 
-    # Remove old requests outside the window
-    old_count = len(user_request_times[user_id])
-    user_request_times[user_id] = [
-        req_time
-        for req_time in user_request_times[user_id]
-        if current_time - req_time < RATE_LIMIT_WINDOW
-    ]
-    new_count = len(user_request_times[user_id])
+def _parse_fetch_response(message_data) -> List[Tuple[bytes, bytes]]:
+    """Pair each message id in a (possibly batched) FETCH response with its payload
 
-    if len(user_request_times[user_id]) >= RATE_LIMIT_MAX_REQUESTS:
-        logger.warning(
-            f"User {user_id} is rate limited - {len(user_request_times[user_id])} requests in window"
-        )
-        return True
+    imaplib returns batched FETCH results as a flat list interleaving
+    (envelope, payload) tuples with closing-paren byte strings; this keeps
+    only the tuples and extracts the leading message id from each envelope.
+    """
+    results = []
+    try:
+        for item in message_data:
+            if not isinstance(item, tuple) or len(item) < 2:
+                continue  # Skip the b")" filler entries between messages
 
-    user_request_times[user_id].append(current_time)
-    return False
+            id_match = re.match(rb"(\d+)", item[0])
+            if not id_match:
+                continue
 
+            results.append((id_match.group(1), item[1]))
+    except Exception as e:
+        logger.error(f"Error parsing FETCH response: {e}")
 
-@asynccontextmanager
-async def get_imap_connection():
-    """Context manager for IMAP connection with proper cleanup"""
-    mail = None
-    try:
-        mail = imaplib.IMAP4_SSL(SERVER)
+    return results
 
-        mail.login(EMAIL, PASSWORD)
-        logger.info("IMAP login successful")
 
-        yield mail
-    except Exception as e:
-        logger.error(f"IMAP connection error: {e}")
-        raise
-    finally:
-        if mail:
-            try:
-                mail.close()
-                mail.logout()
-            except Exception as e:
-                logger.error(f"Error closing IMAP connection: {e}")
+def _parse_imap_list(text: str) -> List:
+    """Parse an IMAP parenthesized list (e.g. a BODYSTRUCTURE) into nested lists
 
+    Quoted strings become str, NIL becomes None, other atoms stay as str.
+    """
+    pos = 0
+
+    def parse() -> List:
+        nonlocal pos
+        items = []
+        while pos < len(text):
+            ch = text[pos]
+            if ch == "(":
+                pos += 1
+                items.append(parse())
+            elif ch == ")":
+                pos += 1
+                return items
+            elif ch == '"':
+                end = text.index('"', pos + 1)
+                items.append(text[pos + 1 : end])
+                pos = end + 1
+            elif ch.isspace():
+                pos += 1
+            else:
+                start = pos
+                while pos < len(text) and text[pos] not in ' ()"':
+                    pos += 1
+                atom = text[start:pos]
+                items.append(None if atom.upper() == "NIL" else atom)
+        return items
 
-async def get_netflix_emails(subject: str) -> Optional[Tuple[str, str]]:
-    """Get Netflix emails from IMAP server"""
-    try:
-        async with get_imap_connection() as mail:
-            mail.select("Inbox")
+    return parse()
 
-            # Handle Unicode characters in search criteria by using charset
-            search_criteria = f'(FROM "info@account.netflix.com" SUBJECT "{subject}")'
 
-            try:
-                # First try with UTF-8 encoding for Unicode subjects
-                status, messages = mail.search("UTF-8", search_criteria)
-            except Exception as e:
-                # Fallback to searching all Netflix emails and filter later
-                broad_search_criteria = '(FROM "info@account.netflix.com")'
-                status, messages = mail.search(None, broad_search_criteria)
+def _find_text_section(structure: List, prefix: str = "") -> Optional[Tuple[str, str, str]]:
+    """Locate the first text/plain part in a parsed BODYSTRUCTURE
 
-            if status != "OK" or not messages[0]:
-                logger.info("No Netflix emails found")
-                return None
+    Returns (section, transfer_encoding, charset) or None. Multipart nodes
+    start with nested part lists; leaf nodes start with the MIME type atom.
+    """
+    if not structure:
+        return None
 
-            mail_ids = messages[0].split()
+    if isinstance(structure[0], list):
+        # Multipart: the leading lists are the child parts, numbered from 1
+        index = 1
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            section = f"{prefix}.{index}" if prefix else str(index)
+            found = _find_text_section(child, section)
+            if found:
+                return found
+            index += 1
+        return None
 
-            # Search through emails to find one with matching subject
-            for mail_id in reversed(mail_ids):  # Start with most recent
-                try:
-                    status, message_data = mail.fetch(mail_id, "(RFC822)")
-                    if status != "OK":
-                        continue
+    if (
+        len(structure) >= 6
+        and str(structure[0]).lower() == "text"
+        and str(structure[1]).lower() == "plain"
+    ):
+        charset = "utf-8"
+        params = structure[2]
+        if isinstance(params, list):
+            for key, value in zip(params[::2], params[1::2]):
+                if str(key).lower() == "charset" and value:
+                    charset = str(value)
 
-                    msg = email.message_from_bytes(message_data[0][1])
-                    raw_subject = msg.get("subject", "")
-                    email_subject = decode_email_subject(raw_subject)
+        encoding = str(structure[5] or "").lower()
+        return prefix or "1", encoding, charset
 
-                    # Check if subject matches (case-insensitive, partial match)
-                    if subject.lower() in email_subject.lower():
+    return None
 
-                        content = _extract_email_content(msg)
-                        if content:
 
-                            # Get email timestamp for expiry checking
-                            email_date = msg.get("Date", "")
+def _decode_part_payload(payload: bytes, encoding: str, charset: str) -> bytes:
+    """Decode a raw BODY[section] payload to UTF-8 bytes
 
-                            return content, email_date
-                        else:
-                            return content, None
-                except Exception as e:
+    Undoes the declared transfer encoding; charsets other than UTF-8/ASCII
+    are transcoded so downstream consumers can assume UTF-8 bytes.
+    """
+    if encoding == "base64":
+        payload = base64.b64decode(payload)
+    elif encoding == "quoted-printable":
+        payload = quopri.decodestring(payload)
+
+    if charset and charset.lower() not in ("utf-8", "us-ascii", "ascii"):
+        try:
+            payload = payload.decode(charset, errors="replace").encode("utf-8")
+        except LookupError:
+            pass  # Unknown charset advertised by the server; keep raw bytes
+
+    return payload
+
+
+def _extract_email_content(msg) -> Optional[bytes]:
+    """Extract text content from email message as raw UTF-8 bytes
+
+    Transfer encoding is undone but the bytes are not decoded to str; callers
+    scan with bytes regexes first and decode only when they have to.
+    """
+    try:
+        if msg.is_multipart():
+            for part in msg.walk():
+                # Filter on cheap metadata before decoding any payloads:
+                # skip container parts and attachments outright so only the
+                # first real text/plain body is ever materialized
+                content_type = part.get_content_type()
+                if content_type.startswith("multipart/"):
+                    continue
+                if part.get("Content-Disposition", "").startswith("attachment"):
+                    continue
+                if content_type != "text/plain":
                     continue
 
-            logger.warning(f"No emails found with subject containing: {subject}")
-            return None
+                content = part.get_payload(decode=True)
+                if content:
+                    return content
+        else:
+            content = msg.get_payload(decode=True)
+            if content:
+                return content
 
+        logger.warning("No text content found in email")
+        return None
     except Exception as e:
-        logger.error(f"Error in get_netflix_emails: {e}")
+        logger.error(f"Error extracting email content: {e}")
         return None
 
 
-# DEBUG FUNCTIONS - Development only
-async def get_recent_email_subjects(count: int = 5) -> List[str]:
-    """Get the subjects of recent Netflix emails for debugging"""
-    try:
-        async with get_imap_connection() as mail:
-            mail.select("Inbox")
+class NetflixCog(commands.Cog):
+    """Netflix email commands plus the pooled resources they share
 
-            # Search for all Netflix emails
-            search_criteria = '(FROM "info@account.netflix.com")'
+    All mutable state — the cached IMAP connection, the HTTP session, the
+    rate limiter, and the email cache — lives on the cog instance, so command
+    hot paths use self attribute lookups instead of module globals and the
+    resources get a clean cog_load/cog_unload lifecycle.
+    """
 
-            status, messages = mail.search(None, search_criteria)
+    # Compiled patterns as class attributes, shared by all instances
 
-            if status != "OK" or not messages[0]:
-                logger.info("No Netflix emails found")
-                return []
+    VERIFY_LINK_REGEX = re.compile(
+        r"\[(https://www\.netflix\.com/account/travel/verify[^\]]*)\]"
+    )
 
-            mail_ids = messages[0].split()
-            if not mail_ids:
-                return []
+    # The verification page renders the PIN in a single known div; a direct
+    # scan is far cheaper than building a full parse tree for one element
+    CHALLENGE_CODE_REGEX = re.compile(
+        r'<div[^>]*class="[^"]*challenge-code[^"]*"[^>]*>\s*([^<]+?)\s*</div>'
+    )
+    CHALLENGE_CODE_REGEX_BYTES = re.compile(
+        rb'<div[^>]*class="[^"]*challenge-code[^"]*"[^>]*>\s*([^<]+?)\s*</div>'
+    )
 
-            # Get the last N emails
-            recent_ids = mail_ids[-count:] if len(mail_ids) >= count else mail_ids
-            subjects = []
+    # Regex pattern for Netflix sign-in codes (typically 6-8 digit codes).
+    # A single alternation of the main pattern and its fallbacks, named by
+    # preference, so extraction needs one pass over the email body instead of
+    # one pass per pattern.
+    COMBINED_CODE_REGEX = re.compile(
+        r"(?:(?:nhập mã này để đăng nhập|mã đăng nhập|sign.?in code|verification code)"
+        r"[^\d\n]*(?P<main>\d{4,8}))"
+        r"|(?:nhập mã này để đăng nhập[\s\n]+nhập mã này để đăng nhập[\s\n]+"
+        r"(?P<vietnamese>\d{4,8}))"
+        r"|(?:^\s*(?P<simple>\d{4,8})\s*$)",
+        re.IGNORECASE | re.MULTILINE,
+    )
 
-            for mail_id in reversed(recent_ids):  # Most recent first
-                try:
-                    status, message_data = mail.fetch(mail_id, "(RFC822)")
-                    if status != "OK":
-                        continue
+    # Last-resort pattern: any 4-8 digit run. Only ever applied to a small
+    # window near a trigger word — HTML bodies are full of tracking ids and
+    # order numbers that would otherwise match
+    FALLBACK_DIGITS_REGEX = re.compile(r"\b(\d{4,8})\b")
+
+    # Bytes fast path for the ASCII trigger phrases: lets code extraction run
+    # on the raw email bytes without decoding the whole body to Unicode
+    # first. The Vietnamese phrases are multi-byte UTF-8 and stay on the
+    # decoded-str path.
+    SIGN_IN_CODE_REGEX_BYTES = re.compile(
+        rb"(?:sign.?in code|verification code)[^\d\n]*(\d{4,8})",
+        re.IGNORECASE | re.MULTILINE,
+    )
 
-                    msg = email.message_from_bytes(message_data[0][1])
-                    raw_subject = msg.get("subject", "No subject")
-                    decoded_subject = decode_email_subject(raw_subject)
-                    subjects.append(decoded_subject)
-                except Exception as e:
-                    continue
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
 
-            logger.info(f"Found {len(subjects)} recent email subjects")
-            return subjects
+        # Persistent IMAP connection shared across commands
+        self.imap_client: Optional[imaplib.IMAP4_SSL] = None
+        self.imap_lock = asyncio.Lock()
+        self.imap_last_used = 0.0
+        self.keepalive_task: Optional[asyncio.Task] = None
 
-    except Exception as e:
-        logger.error(f"Error getting recent email subjects: {e}")
-        return []
+        # Shared HTTP session so !verify reuses TCP/TLS connections
+        self.http_session: Optional[aiohttp.ClientSession] = None
 
+        # Rate limiting
+        self.user_request_times = defaultdict(
+            lambda: deque(maxlen=RATE_LIMIT_MAX_REQUESTS + 1)
+        )
+        self.janitor_task: Optional[asyncio.Task] = None
 
-async def get_latest_email_subject() -> Optional[str]:
-    """Get the subject of the latest Netflix email for debugging"""
-    try:
-        async with get_imap_connection() as mail:
-            mail.select("Inbox")
+        # mail_id -> (expires_at, subject, date_header, content)
+        self.email_cache = {}
 
-            # Search for all Netflix emails
-            search_criteria = '(FROM "info@account.netflix.com")'
+    async def cog_load(self):
+        self.http_session = self._create_http_session()
+        self.keepalive_task = asyncio.create_task(self._imap_keepalive())
+        self.janitor_task = asyncio.create_task(self._rate_limit_janitor())
+        logger.info("NetflixCog loaded: HTTP session and background tasks started")
 
-            status, messages = mail.search(None, search_criteria)
+    async def cog_unload(self):
+        for task in (self.keepalive_task, self.janitor_task):
+            if task is not None:
+                task.cancel()
 
-            if status != "OK" or not messages[0]:
-                logger.info("No Netflix emails found")
-                return None
+        async with self.imap_lock:
+            await self._drop_imap_client()
 
-            mail_ids = messages[0].split()
-            if not mail_ids:
-                return None
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
 
-            # Get the latest email (last ID)
-            latest_mail_id = mail_ids[-1]
+        logger.info("NetflixCog unloaded: pooled resources released")
 
-            status, message_data = mail.fetch(latest_mail_id, "(RFC822)")
-            if status != "OK":
-                logger.error("Error fetching latest email")
-                return None
+    # --- Rate limiting ---
+
+    def is_rate_limited(self, user_id: int) -> bool:
+        """Check if user is rate limited"""
+        current_time = time.time()
+        request_times = self.user_request_times[user_id]
 
-            msg = email.message_from_bytes(message_data[0][1])
-            raw_subject = msg.get("subject", "No subject")
-            decoded_subject = decode_email_subject(raw_subject)
+        # Evict requests that have slid out of the window
+        while request_times and current_time - request_times[0] >= RATE_LIMIT_WINDOW:
+            request_times.popleft()
 
-            logger.info(f"Latest Netflix email subject (decoded): {decoded_subject}")
-            print(f"DEBUG - Latest Netflix email subject (decoded): {decoded_subject}")
+        if len(request_times) >= RATE_LIMIT_MAX_REQUESTS:
+            logger.warning(
+                f"User {user_id} is rate limited - {len(request_times)} requests in window"
+            )
+            return True
+
+        request_times.append(current_time)
+        return False
+
+    async def _rate_limit_janitor(self):
+        """Periodically drop idle users from the rate limiter
+
+        Without eviction every user who ever ran a command stays in the dict
+        for the life of the process; this sweep keeps the rate limiter
+        constant-space.
+        """
+        while True:
+            await asyncio.sleep(RATE_LIMIT_JANITOR_INTERVAL)
+            now = time.time()
+            evicted = 0
+
+            for user_id, request_times in list(self.user_request_times.items()):
+                while request_times and now - request_times[0] >= RATE_LIMIT_WINDOW:
+                    request_times.popleft()
+                if not request_times:
+                    del self.user_request_times[user_id]
+                    evicted += 1
+
+            if evicted:
+                logger.debug(f"Rate limit janitor evicted {evicted} idle users")
+
+    # --- IMAP connection management ---
+
+    async def _drop_imap_client(self) -> None:
+        """Discard the cached IMAP connection, closing it on a best-effort basis
+
+        The client is detached (and the per-session email cache cleared)
+        immediately; the blocking close/logout network calls then run in a
+        worker thread so a half-open connection can't stall the event loop.
+        """
+        client, self.imap_client = self.imap_client, None
+        # Message ids are per-session, so cached entries die with the client
+        self.email_cache.clear()
+
+        if client is None:
+            return
 
-            return decoded_subject
+        try:
+            await asyncio.to_thread(self._close_imap, client)
+        except Exception as e:
+            logger.debug(f"Error closing stale IMAP connection: {e}")
 
-    except Exception as e:
-        logger.error(f"Error getting latest email subject: {e}")
+    @staticmethod
+    def _close_imap(client: imaplib.IMAP4_SSL) -> None:
+        """Blocking teardown of a detached IMAP connection"""
+        client.close()
+        client.logout()
+
+    @staticmethod
+    def _connect_imap() -> imaplib.IMAP4_SSL:
+        """Open and authenticate a fresh IMAP connection"""
+        mail = imaplib.IMAP4_SSL(SERVER)
+        mail.login(EMAIL, PASSWORD)
+        logger.info("IMAP login successful")
+        return mail
+
+    @asynccontextmanager
+    async def get_imap_connection(self):
+        """Context manager yielding the long-lived IMAP connection
+
+        The connection is cached on the cog and reused across commands to
+        avoid a fresh TLS handshake and LOGIN per request. A cheap NOOP
+        verifies the cached socket is still alive; on failure the cache is
+        dropped and a new connection is opened transparently.
+        """
+        async with self.imap_lock:
+            try:
+                if self.imap_client is not None:
+                    try:
+                        await asyncio.to_thread(self.imap_client.noop)
+                    except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                        logger.info(
+                            f"Cached IMAP connection is stale, reconnecting: {e}"
+                        )
+                        await self._drop_imap_client()
+
+                if self.imap_client is None:
+                    self.imap_client = await asyncio.to_thread(self._connect_imap)
+
+                self.imap_last_used = time.time()
+                yield self.imap_client
+            except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                logger.error(f"IMAP connection error: {e}")
+                await self._drop_imap_client()
+                raise
+            except Exception as e:
+                logger.error(f"IMAP connection error: {e}")
+                raise
+
+    async def _imap_keepalive(self):
+        """Send a periodic NOOP so Gmail doesn't drop the idle cached connection"""
+        while True:
+            await asyncio.sleep(IMAP_KEEPALIVE_INTERVAL)
+            async with self.imap_lock:
+                if self.imap_client is None:
+                    continue
+
+                if time.time() - self.imap_last_used < IMAP_KEEPALIVE_INTERVAL:
+                    continue  # Connection was used recently, no NOOP needed
+
+                try:
+                    await asyncio.to_thread(self.imap_client.noop)
+                    logger.debug("IMAP keepalive NOOP sent")
+                except Exception as e:
+                    logger.info(f"IMAP keepalive failed, dropping connection: {e}")
+                    await self._drop_imap_client()
+
+    # --- Email content cache ---
+
+    def _email_cache_get(self, subject: str) -> Optional[Tuple[bytes, str]]:
+        """Return (content, date_header) for a cached email matching the subject"""
+        now = time.time()
+        for mail_id, (expires_at, cached_subject, email_date, content) in list(
+            self.email_cache.items()
+        ):
+            if now >= expires_at:
+                del self.email_cache[mail_id]
+                continue
+            if subject.lower() in cached_subject.lower():
+                return content, email_date
         return None
 
+    def _email_cache_put(
+        self, mail_id, subject: str, email_date: str, content: bytes
+    ) -> None:
+        """Cache one fetched email, evicting the entry closest to expiry if full"""
+        if len(self.email_cache) >= EMAIL_CACHE_MAX_ENTRIES:
+            oldest = min(self.email_cache, key=lambda key: self.email_cache[key][0])
+            del self.email_cache[oldest]
+        self.email_cache[mail_id] = (
+            time.time() + EMAIL_CACHE_TTL,
+            subject,
+            email_date,
+            content,
+        )
+
+    # --- Email retrieval ---
 
-async def get_sign_in_code() -> Optional[Tuple[str, bool, str]]:
-    """Get sign in code from Netflix email with expiry check
-    Returns: (code, is_expired, expiry_message) or None
-    """
-    logger.debug("Starting sign in code retrieval")
-    try:
-        # Get the latest email subjects to find one with sign-in code
-        recent_subjects = await get_recent_email_subjects(count=10)
-        logger.debug(f"Retrieved {len(recent_subjects)} recent email subjects")
+    async def _fetch_email_content(self, mail, mail_id) -> Optional[bytes]:
+        """Fetch the text content of one message, transferring as little as possible
+
+        Probes BODYSTRUCTURE to locate the first text/plain section, then
+        fetches only that section with BODY.PEEK and decodes its transfer
+        encoding directly — skipping the HTML alternative and any inline
+        images entirely. Falls back to a full RFC822 fetch when the structure
+        can't be parsed.
+        """
+        try:
+            status, data = await asyncio.to_thread(
+                mail.fetch, mail_id, "(BODYSTRUCTURE)"
+            )
+            if status == "OK" and data and data[0]:
+                raw = data[0][0] if isinstance(data[0], tuple) else data[0]
+                text = raw.decode("utf-8", errors="replace")
+                marker = text.find("BODYSTRUCTURE")
+                if marker != -1:
+                    start = text.index("(", marker)
+                    structure = _parse_imap_list(text[start + 1 :])
+                    found = _find_text_section(structure)
+                    if found:
+                        section, encoding, charset = found
+                        status, part_data = await asyncio.to_thread(
+                            mail.fetch, mail_id, f"(BODY.PEEK[{section}])"
+                        )
+                        if status == "OK":
+                            parsed = _parse_fetch_response(part_data)
+                            if parsed:
+                                return _decode_part_payload(
+                                    parsed[0][1], encoding, charset
+                                )
+        except Exception as e:
+            logger.debug(
+                f"BODYSTRUCTURE fetch failed for {mail_id}, falling back to RFC822: {e}"
+            )
 
-        if not recent_subjects:
-            logger.warning("No recent Netflix emails found")
+        status, message_data = await asyncio.to_thread(mail.fetch, mail_id, "(RFC822)")
+        if status != "OK":
             return None
 
-        # Keywords to match in subject for sign-in codes
-        sign_in_keywords = ["mã đăng nhập", "sign-in code"]
+        msg = email.message_from_bytes(message_data[0][1])
+        return _extract_email_content(msg)
 
-        # Look for an email with sign-in code keywords (iterate from newest to oldest)
-        for email_subject in recent_subjects:
-            subject_lower = email_subject.lower()
-            has_sign_in_keyword = any(
-                keyword.lower() in subject_lower for keyword in sign_in_keywords
-            )
+    async def get_netflix_emails(self, subject: str) -> Optional[Tuple[bytes, str]]:
+        """Get Netflix emails from IMAP server
 
-            if not has_sign_in_keyword:
-                logger.debug(
-                    f"Subject '{email_subject}' does not contain sign-in code keywords"
+        Returns (content_bytes, date_header); content stays as UTF-8 bytes so
+        callers can scan it without paying for a full Unicode decode up front.
+        """
+        try:
+            cached = self._email_cache_get(subject)
+            if cached is not None:
+                logger.debug(f"Email cache hit for subject: {subject}")
+                return cached
+
+            async with self.get_imap_connection() as mail:
+                await asyncio.to_thread(mail.select, "Inbox")
+
+                # Bound the search server-side; the bot only cares about fresh codes
+                since = _imap_since_date()
+
+                # Handle Unicode characters in search criteria by using charset
+                search_criteria = (
+                    f'(FROM "info@account.netflix.com" SUBJECT "{subject}" SINCE {since})'
                 )
-                continue
 
-            logger.debug(f"Found matching subject: {email_subject}")
-            # Use the first keyword that matches for the search
-            matching_keyword = next(
-                kw for kw in sign_in_keywords if kw.lower() in subject_lower
-            )
-            result = await get_netflix_emails(matching_keyword)
+                # Prefer the SORT extension: the server returns ids newest
+                # first, so only a handful of candidates ever need scanning
+                recent_ids = None
+                try:
+                    status, messages = await asyncio.to_thread(
+                        mail.sort, "(REVERSE DATE)", "UTF-8", search_criteria
+                    )
+                    if status == "OK":
+                        recent_ids = (messages[0] or b"").split()[
+                            :IMAP_SORT_CANDIDATE_LIMIT
+                        ]
+                except (imaplib.IMAP4.error, UnicodeEncodeError) as e:
+                    # UnicodeEncodeError: imaplib can't send non-ASCII criteria
+                    # (e.g. Vietnamese subjects) through SORT; the UTF-8 SEARCH
+                    # below handles those
+                    logger.debug(f"SORT unavailable, falling back to SEARCH: {e}")
+
+                if recent_ids is None:
+                    try:
+                        # First try with UTF-8 encoding for Unicode subjects
+                        status, messages = await asyncio.to_thread(
+                            mail.search, "UTF-8", search_criteria
+                        )
+                    except Exception as e:
+                        # Fallback to searching all Netflix emails and filter later
+                        broad_search_criteria = (
+                            f'(FROM "info@account.netflix.com" SINCE {since})'
+                        )
+                        status, messages = await asyncio.to_thread(
+                            mail.search, None, broad_search_criteria
+                        )
+
+                    if status != "OK" or not messages[0]:
+                        logger.info("No Netflix emails found")
+                        return None
+
+                    # SEARCH returns ids oldest first; order newest first and
+                    # cap the candidate set client-side
+                    mail_ids = messages[0].split()
+                    recent_ids = list(reversed(mail_ids))[:IMAP_FETCH_BATCH_LIMIT]
+
+                if not recent_ids:
+                    logger.info("No Netflix emails found")
+                    return None
 
-            if not result:
-                logger.debug(f"No email content found for subject: {email_subject}")
-                continue
+                # Batch the header scan into one FETCH instead of one round
+                # trip per message
+                fetch_set = b",".join(recent_ids)
+                status, message_data = await asyncio.to_thread(
+                    mail.fetch, fetch_set, "(BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])"
+                )
+                if status != "OK":
+                    logger.error("Error fetching email headers")
+                    return None
 
-            content, email_date_str = result
-            logger.debug(
-                f"Email content received for subject '{email_subject}', length: {len(content)}"
-            )
-            print(
-                f"DEBUG - Email content for '{email_subject}': {content[:500]}..."
-            )  # DEBUG: Print first 500 chars for debugging
+                headers_by_id = dict(_parse_fetch_response(message_data))
+
+                # Search through emails to find one with matching subject;
+                # recent_ids is already ordered newest first
+                for mail_id in recent_ids:
+                    try:
+                        raw_headers = headers_by_id.get(mail_id)
+                        if raw_headers is None:
+                            continue
+
+                        msg = email.message_from_bytes(raw_headers)
+                        raw_subject = msg.get("subject", "")
+                        email_subject = decode_email_subject(raw_subject)
+
+                        # Check if subject matches (case-insensitive, partial match)
+                        if subject.lower() in email_subject.lower():
+
+                            # One targeted fetch of just the text section of
+                            # the matched message
+                            content = await self._fetch_email_content(mail, mail_id)
+                            if content:
+
+                                # Get email timestamp for expiry checking; the
+                                # header scan already fetched the Date field
+                                email_date = msg.get("Date", "")
+
+                                self._email_cache_put(
+                                    mail_id, email_subject, email_date, content
+                                )
+                                return content, email_date
+                            else:
+                                return content, None
+                    except Exception as e:
+                        continue
+
+                logger.warning(f"No emails found with subject containing: {subject}")
+                return None
 
-            # Parse email date for expiry checking
-            email_date = parse_email_date(email_date_str) if email_date_str else None
+        except Exception as e:
+            logger.error(f"Error in get_netflix_emails: {e}")
+            return None
 
-            found_code = None
+    # DEBUG FUNCTIONS - Development only
+    async def get_recent_email_subjects(self, count: int = 5) -> List[str]:
+        """Get the subjects of recent Netflix emails for debugging"""
+        try:
+            async with self.get_imap_connection() as mail:
+                await asyncio.to_thread(mail.select, "Inbox")
 
-            match = SIGN_IN_CODE_REGEX.search(content)
-            logger.debug("Searching for sign in code using SIGN_IN_CODE_REGEX")
-            logger.debug(f"Sign in code regex match: {match}")
-            if match:
-                found_code = match.group(1)
-                logger.info(f"Sign in code found: {found_code}")
-            else:
-                logger.warning("No sign in code found in email content")
-                logger.debug("Email content does not match sign in code pattern")
-
-                # Try alternative patterns for Vietnamese format
-                # Look for standalone 4-8 digit numbers after Vietnamese login text
-                vietnamese_pattern = re.search(
-                    r"nhập mã này để đăng nhập[\s\n]+nhập mã này để đăng nhập[\s\n]+(\d{4,8})",
-                    content,
-                    re.IGNORECASE | re.MULTILINE,
+                # Search for recent Netflix emails; SINCE prunes old hits server-side
+                search_criteria = (
+                    f'(FROM "info@account.netflix.com" SINCE {_imap_since_date()})'
                 )
-                if vietnamese_pattern:
-                    found_code = vietnamese_pattern.group(1)
-                    pattern_used = "Vietnamese pattern"
-                    logger.info(f"Vietnamese pattern found code: {found_code}")
-                else:
-                    # Try simple standalone number pattern
-                    simple_code_match = re.search(
-                        r"^\s*(\d{4,8})\s*$", content, re.MULTILINE
+
+                status, messages = await asyncio.to_thread(
+                    mail.search, None, search_criteria
+                )
+
+                if status != "OK" or not messages[0]:
+                    logger.info("No Netflix emails found")
+                    return []
+
+                mail_ids = messages[0].split()
+                if not mail_ids:
+                    return []
+
+                # Get the last N emails with a single batched header-only
+                # fetch; subjects never need the message bodies
+                recent_ids = mail_ids[-count:] if len(mail_ids) >= count else mail_ids
+                fetch_set = b",".join(recent_ids)
+                status, message_data = await asyncio.to_thread(
+                    mail.fetch, fetch_set, "(BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])"
+                )
+                if status != "OK":
+                    logger.error("Error fetching recent email headers")
+                    return []
+
+                messages_by_id = dict(_parse_fetch_response(message_data))
+                subjects = []
+
+                for mail_id in reversed(recent_ids):  # Most recent first
+                    try:
+                        raw_message = messages_by_id.get(mail_id)
+                        if raw_message is None:
+                            continue
+
+                        msg = email.message_from_bytes(raw_message)
+                        raw_subject = msg.get("subject", "No subject")
+                        decoded_subject = decode_email_subject(raw_subject)
+                        subjects.append(decoded_subject)
+                    except Exception as e:
+                        continue
+
+                logger.info(f"Found {len(subjects)} recent email subjects")
+                return subjects
+
+        except Exception as e:
+            logger.error(f"Error getting recent email subjects: {e}")
+            return []
+
+    async def get_latest_email_subject(self) -> Optional[str]:
+        """Get the subject of the latest Netflix email for debugging"""
+        try:
+            async with self.get_imap_connection() as mail:
+                await asyncio.to_thread(mail.select, "Inbox")
+
+                # Search for all Netflix emails
+                search_criteria = '(FROM "info@account.netflix.com")'
+
+                status, messages = await asyncio.to_thread(
+                    mail.search, None, search_criteria
+                )
+
+                if status != "OK" or not messages[0]:
+                    logger.info("No Netflix emails found")
+                    return None
+
+                mail_ids = messages[0].split()
+                if not mail_ids:
+                    return None
+
+                # Get the latest email (last ID)
+                latest_mail_id = mail_ids[-1]
+
+                # Header-only fetch; the subject is all this helper needs
+                status, message_data = await asyncio.to_thread(
+                    mail.fetch,
+                    latest_mail_id,
+                    "(BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])",
+                )
+                if status != "OK":
+                    logger.error("Error fetching latest email")
+                    return None
+
+                msg = email.message_from_bytes(message_data[0][1])
+                raw_subject = msg.get("subject", "No subject")
+                decoded_subject = decode_email_subject(raw_subject)
+
+                logger.info(
+                    f"Latest Netflix email subject (decoded): {decoded_subject}"
+                )
+                print(
+                    f"DEBUG - Latest Netflix email subject (decoded): {decoded_subject}"
+                )
+
+                return decoded_subject
+
+        except Exception as e:
+            logger.error(f"Error getting latest email subject: {e}")
+            return None
+
+    # --- Code extraction ---
+
+    async def get_sign_in_code(self) -> Optional[Tuple[str, bool, str]]:
+        """Get sign in code from Netflix email with expiry check
+        Returns: (code, is_expired, expiry_message) or None
+        """
+        logger.debug("Starting sign in code retrieval")
+        try:
+            # Get the latest email subjects to find one with sign-in code
+            recent_subjects = await self.get_recent_email_subjects(count=10)
+            logger.debug(f"Retrieved {len(recent_subjects)} recent email subjects")
+
+            if not recent_subjects:
+                logger.warning("No recent Netflix emails found")
+                return None
+
+            # Keywords to match in subject for sign-in codes
+            sign_in_keywords = ["mã đăng nhập", "sign-in code"]
+
+            # Look for an email with sign-in code keywords (iterate from newest to oldest)
+            for email_subject in recent_subjects:
+                subject_lower = email_subject.lower()
+                has_sign_in_keyword = any(
+                    keyword.lower() in subject_lower for keyword in sign_in_keywords
+                )
+
+                if not has_sign_in_keyword:
+                    logger.debug(
+                        f"Subject '{email_subject}' does not contain sign-in code keywords"
                     )
-                    if simple_code_match:
-                        found_code = simple_code_match.group(1)
-                        pattern_used = "simple pattern"
-                        logger.info(f"Simple pattern found code: {found_code}")
-                    else:
-                        # Last resort: any 4-8 digit number
-                        fallback_match = re.search(r"\b(\d{4,8})\b", content)
-                        if fallback_match:
-                            found_code = fallback_match.group(1)
-                            pattern_used = "fallback pattern"
-                            logger.info(f"Fallback pattern found code: {found_code}")
-
-            if found_code:
-                # Check expiry
-                is_expired, expiry_msg = is_code_expired(email_date)
-                logger.info(f"Code {found_code} expiry check: {expiry_msg}")
-                return found_code, is_expired, expiry_msg
-
-        logger.warning("No sign in code found in any Netflix emails")
-        return None
+                    continue
 
-    except Exception as e:
-        logger.error(f"Error in get_sign_in_code: {e}")
-        return None
+                logger.debug(f"Found matching subject: {email_subject}")
+                # Use the first keyword that matches for the search
+                matching_keyword = next(
+                    kw for kw in sign_in_keywords if kw.lower() in subject_lower
+                )
+                result = await self.get_netflix_emails(matching_keyword)
 
+                if not result:
+                    logger.debug(
+                        f"No email content found for subject: {email_subject}"
+                    )
+                    continue
 
-async def get_verify_link() -> Optional[str]:
-    """Get verification link from Netflix email asynchronously"""
-    try:
-        result = await _get_verify_link_async("temporary access code")
-        return result
-    except Exception as e:
-        logger.error(f"Error getting verify link: {e}")
-        return None
+                content, email_date_str = result
+                logger.debug(
+                    f"Email content received for subject '{email_subject}', length: {len(content)}"
+                )
+                print(
+                    f"DEBUG - Email content for '{email_subject}': {content[:500]}..."
+                )  # DEBUG: Print first 500 chars for debugging
 
+                # Parse email date once into a timestamp for expiry checking
+                email_date_ts = (
+                    parse_email_date(email_date_str) if email_date_str else None
+                )
 
-async def _get_verify_link_async(subject: str) -> Optional[str]:
-    """Async version of get_verify_link"""
-    try:
-        content = await get_netflix_emails(subject)
+                found_code = self._extract_sign_in_code(content)
 
-        if not content:
-            logger.warning("No email content found for verification link")
+                if found_code:
+                    # Check expiry
+                    is_expired, expiry_msg = is_code_expired(email_date_ts)
+                    logger.info(f"Code {found_code} expiry check: {expiry_msg}")
+                    return found_code, is_expired, expiry_msg
+
+            logger.warning("No sign in code found in any Netflix emails")
+            return None
+
+        except Exception as e:
+            logger.error(f"Error in get_sign_in_code: {e}")
             return None
 
-        match = VERIFY_LINK_REGEX.search(content)
+    def _extract_sign_in_code(self, content: bytes) -> Optional[str]:
+        """Pull the sign-in code out of one email body"""
+        # Fast path: scan the raw bytes for the ASCII trigger phrases before
+        # paying for a full Unicode decode of the body
+        bytes_match = self.SIGN_IN_CODE_REGEX_BYTES.search(content)
+        logger.debug(f"Sign in code bytes regex match: {bytes_match}")
+        if bytes_match:
+            found_code = bytes_match.group(1).decode("ascii")
+            logger.info(f"Sign in code found: {found_code}")
+            return found_code
+
+        # The Vietnamese trigger phrases are multi-byte UTF-8, so the
+        # fallbacks run over the decoded text
+        content_text = content.decode("utf-8", errors="replace")
+        match = self.COMBINED_CODE_REGEX.search(content_text)
+        logger.debug("Searching for sign in code using COMBINED_CODE_REGEX")
+        logger.debug(f"Sign in code regex match: {match}")
         if match:
-            link = match.group(1)
-            logger.info(f"Verification link found: {link[:50]}...")
-            return link
+            # Dispatch on whichever named alternative matched
+            pattern_used, found_code = next(
+                (name, value)
+                for name, value in match.groupdict().items()
+                if value is not None
+            )
+            logger.info(f"Sign in code found via {pattern_used} pattern: {found_code}")
+            return found_code
+
+        # Last resort: any 4-8 digit number, but only inside a bounded window
+        # after the first "netflix" mention so unrelated ids elsewhere in the
+        # body can't match
+        trigger_idx = content_text.lower().find("netflix")
+        if trigger_idx != -1:
+            search_region = content_text[
+                trigger_idx : trigger_idx + FALLBACK_SEARCH_WINDOW
+            ]
         else:
-            logger.warning("No verification link found in email content")
-            return None
+            search_region = content_text[:FALLBACK_SEARCH_WINDOW]
 
-    except Exception as e:
-        logger.error(f"Error in _get_verify_link_sync: {e}")
+        fallback_match = self.FALLBACK_DIGITS_REGEX.search(search_region)
+        if fallback_match:
+            found_code = fallback_match.group(1)
+            logger.info(f"Fallback pattern found code: {found_code}")
+            return found_code
+
+        logger.warning("No sign in code found in email content")
+        logger.debug("Email content does not match sign in code pattern")
         return None
 
+    # --- Verification link handling ---
 
-def _extract_email_content(msg) -> Optional[str]:
-    """Extract text content from email message"""
-    try:
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    content = part.get_payload(decode=True).decode(
-                        "utf-8", errors="replace"
-                    )
-                    if content:
-                        return content
-        else:
-            content = msg.get_payload(decode=True).decode("utf-8", errors="replace")
-            if content:
-                return content
+    async def get_verify_link(self) -> Optional[str]:
+        """Get verification link from Netflix email asynchronously"""
+        try:
+            result = await self._get_verify_link_async("temporary access code")
+            return result
+        except Exception as e:
+            logger.error(f"Error getting verify link: {e}")
+            return None
 
-        logger.warning("No text content found in email")
-        return None
-    except Exception as e:
-        logger.error(f"Error extracting email content: {e}")
-        return None
+    async def _get_verify_link_async(self, subject: str) -> Optional[str]:
+        """Async version of get_verify_link"""
+        try:
+            result = await self.get_netflix_emails(subject)
 
+            if not result or not result[0]:
+                logger.warning("No email content found for verification link")
+                return None
 
-async def access_verify_link() -> Optional[str]:
-    """Access verification link and extract challenge code asynchronously"""
-    try:
-        link = await get_verify_link()
-        if not link:
-            logger.warning("No verification link available")
+            content, _ = result
+            match = self.VERIFY_LINK_REGEX.search(
+                content.decode("utf-8", errors="replace")
+            )
+            if match:
+                link = match.group(1)
+                logger.info(f"Verification link found: {link[:50]}...")
+                return link
+            else:
+                logger.warning("No verification link found in email content")
+                return None
+
+        except Exception as e:
+            logger.error(f"Error in _get_verify_link_sync: {e}")
             return None
 
-        # Use aiohttp for async HTTP requests
-        timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(link) as response:
+    @staticmethod
+    def _create_http_session() -> aiohttp.ClientSession:
+        """Build the shared HTTP session with pooling-friendly connector settings"""
+        return aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300),
+        )
 
-                if response.status == 200:
-                    html_content = await response.text()
+    async def access_verify_link(self) -> Optional[str]:
+        """Access verification link and extract challenge code asynchronously"""
+        try:
+            link = await self.get_verify_link()
+            if not link:
+                logger.warning("No verification link available")
+                return None
 
-                    challenge_code = _extract_challenge_code(html_content)
-                    if challenge_code:
-                        logger.info(f"Challenge code extracted: {challenge_code}")
-                    else:
-                        logger.warning("No challenge code found in HTML")
-                    return challenge_code
-                else:
+            # Reuse the shared session; recreate lazily if it was closed
+            if self.http_session is None or self.http_session.closed:
+                self.http_session = self._create_http_session()
+
+            async with self.http_session.get(link) as response:
+
+                if response.status != 200:
                     logger.error(
                         f"Failed to access verification link, status: {response.status}"
                     )
                     return None
 
-    except asyncio.TimeoutError:
-        logger.error("Timeout accessing verification link")
-        return None
-    except Exception as e:
-        logger.error(f"Error accessing verification link: {e}")
-        return None
-
-
-def _extract_challenge_code(html_content: str) -> Optional[str]:
-    """Extract challenge code from HTML content"""
-    try:
-        from bs4 import BeautifulSoup
+                # Stream the page and stop as soon as the challenge-code div
+                # has fully arrived instead of buffering the whole body first
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(8192):
+                    buffer += chunk
+
+                    match = self.CHALLENGE_CODE_REGEX_BYTES.search(buffer)
+                    if match:
+                        response.close()  # Abort the rest of the download
+                        challenge_code = (
+                            match.group(1).strip().decode("utf-8", errors="replace")
+                        )
+                        logger.info(f"Challenge code extracted: {challenge_code}")
+                        return challenge_code
+
+                    if len(buffer) >= VERIFY_MAX_RESPONSE_BYTES:
+                        logger.warning(
+                            "Verification page exceeded size cap without a challenge code"
+                        )
+                        response.close()
+                        break
+
+                # Last look at whatever was buffered, in case the div
+                # straddled the final chunk in an unexpected form
+                challenge_code = self._extract_challenge_code(
+                    buffer.decode("utf-8", errors="replace")
+                )
+                if challenge_code:
+                    logger.info(f"Challenge code extracted: {challenge_code}")
+                else:
+                    logger.warning("No challenge code found in HTML")
+                return challenge_code
 
-        soup = BeautifulSoup(html_content, "html.parser")
+        except asyncio.TimeoutError:
+            logger.error("Timeout accessing verification link")
+            return None
+        except Exception as e:
+            logger.error(f"Error accessing verification link: {e}")
+            return None
 
-        challenge_code_div = soup.find("div", class_="challenge-code")
+    def _extract_challenge_code(self, html_content: str) -> Optional[str]:
+        """Extract challenge code from HTML content"""
+        try:
+            match = self.CHALLENGE_CODE_REGEX.search(html_content)
 
-        if challenge_code_div:
-            code = challenge_code_div.get_text(strip=True)
-            if code:
-                logger.info(f"Successfully extracted challenge code: {code}")
-                return code
+            if match:
+                code = match.group(1).strip()
+                if code:
+                    logger.info(f"Successfully extracted challenge code: {code}")
+                    return code
+                else:
+                    logger.warning("Challenge code div is empty")
             else:
-                logger.warning("Challenge code div is empty")
-        else:
-            logger.warning("No challenge code div found in HTML")
-        logger.warning("No challenge code found in HTML content")
-        return None
+                logger.warning("No challenge code div found in HTML")
+            logger.warning("No challenge code found in HTML content")
+            return None
 
-    except Exception as e:
-        logger.error(f"Error extracting challenge code: {e}")
-        return None
+        except Exception as e:
+            logger.error(f"Error extracting challenge code: {e}")
+            return None
 
+    # --- Events and commands ---
+
+    @commands.Cog.listener()
+    async def on_disconnect(self):
+        """Release pooled connections when the gateway drops"""
+        async with self.imap_lock:
+            await self._drop_imap_client()
+
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
+
+    @commands.command(name="hello")
+    async def hello(self, ctx):
+        """Simple hello command to verify bot is active"""
+        user_id = ctx.author.id
+        user_name = ctx.author.name
+        channel_id = ctx.channel.id
+
+        try:
+            await ctx.send("Hello! How can I assist you today?")
+        except Exception as e:
+            logger.error(f"Error in hello command: {e}")
+
+    @commands.command(name="signin")
+    async def signin(self, ctx):
+        """Get Netflix sign-in code"""
+        user_id = ctx.author.id
+        user_name = ctx.author.name
+        channel_id = ctx.channel.id
+
+        logger.info(
+            f"Sign-in command triggered by user {user_id} ({user_name}) in channel {channel_id}"
+        )
 
-@bot.event
-async def on_ready():
-    logger.info(f"Logged in as {bot.user}")
-    logger.info(f"Bot is ready to serve {len(bot.guilds)} guilds")
+        try:
+            # Check rate limiting
+            if self.is_rate_limited(user_id):
+                logger.warning(f"User {user_id} ({user_name}) hit rate limit")
+                await ctx.send(
+                    "⚠️ Rate limit exceeded. Please wait before trying again."
+                )
+                return
 
+            await ctx.send("🔍 Searching for Netflix sign-in code email...")
 
-@bot.command(name="hello")
-async def hello(ctx):
-    """Simple hello command to verify bot is active"""
-    user_id = ctx.author.id
-    user_name = ctx.author.name
-    channel_id = ctx.channel.id
+            result = await self.get_sign_in_code()
 
-    try:
-        await ctx.send("Hello! How can I assist you today?")
-    except Exception as e:
-        logger.error(f"Error in hello command: {e}")
+            if result:
+                code, is_expired, expiry_msg = result
+                logger.info(
+                    f"Successfully retrieved sign-in code for user {user_id}: {code} - {expiry_msg}"
+                )
 
+                if is_expired:
+                    await ctx.send(
+                        f"⚠️ Sign-in code: **{code}** (EXPIRED)\n❌ {expiry_msg}"
+                    )
+                else:
+                    await ctx.send(f"✅ Sign-in code: **{code}**\n⏰ {expiry_msg}")
+            else:
+                logger.warning(f"Failed to retrieve sign-in code for user {user_id}")
+                await ctx.send(
+                    "❌ Failed to get the sign-in code. Please ensure you've requested a sign-in code from Netflix first."
+                )
 
-@bot.command(name="signin")
-async def signin(ctx):
-    """Get Netflix sign-in code"""
-    user_id = ctx.author.id
-    user_name = ctx.author.name
-    channel_id = ctx.channel.id
+        except Exception as e:
+            logger.error(f"Error in signin command for user {user_id}: {e}")
+            await ctx.send("❌ An error occurred while processing your request.")
 
-    logger.info(
-        f"Sign-in command triggered by user {user_id} ({user_name}) in channel {channel_id}"
-    )
+    @commands.command(name="verify")
+    async def verify(self, ctx):
+        """Get Netflix verification PIN code"""
+        user_id = ctx.author.id
+        user_name = ctx.author.name
+        channel_id = ctx.channel.id
 
-    try:
-        # Check rate limiting
-        if is_rate_limited(user_id):
-            logger.warning(f"User {user_id} ({user_name}) hit rate limit")
-            await ctx.send("⚠️ Rate limit exceeded. Please wait before trying again.")
-            return
+        logger.info(
+            f"Verify command triggered by user {user_id} ({user_name}) in channel {channel_id}"
+        )
 
-        await ctx.send("🔍 Searching for Netflix sign-in code email...")
+        try:
+            if self.is_rate_limited(user_id):
+                logger.warning(f"User {user_id} ({user_name}) hit rate limit")
+                await ctx.send(
+                    "⚠️ Rate limit exceeded. Please wait before trying again."
+                )
+                return
 
-        result = await get_sign_in_code()
+            await ctx.send("🔍 Searching for Netflix verification email...")
 
-        if result:
-            code, is_expired, expiry_msg = result
-            logger.info(
-                f"Successfully retrieved sign-in code for user {user_id}: {code} - {expiry_msg}"
-            )
+            challenge_code = await self.access_verify_link()
 
-            if is_expired:
-                await ctx.send(f"⚠️ Sign-in code: **{code}** (EXPIRED)\n❌ {expiry_msg}")
+            if challenge_code:
+                logger.info(
+                    f"Successfully retrieved challenge code for user {user_id}: {challenge_code}"
+                )
+                await ctx.send(f"✅ Challenge code: **{challenge_code}**")
             else:
-                await ctx.send(f"✅ Sign-in code: **{code}**\n⏰ {expiry_msg}")
-        else:
-            logger.warning(f"Failed to retrieve sign-in code for user {user_id}")
-            await ctx.send(
-                "❌ Failed to get the sign-in code. Please ensure you've requested a sign-in code from Netflix first."
-            )
+                logger.warning(f"Failed to retrieve challenge code for user {user_id}")
+                await ctx.send(
+                    "❌ Failed to get the challenge code. Please ensure you've requested a PIN from Netflix first."
+                )
 
-    except Exception as e:
-        logger.error(f"Error in signin command for user {user_id}: {e}")
-        await ctx.send("❌ An error occurred while processing your request.")
+        except Exception as e:
+            logger.error(f"Error in verify command for user {user_id}: {e}")
+            await ctx.send("❌ An error occurred while processing your request.")
 
 
-@bot.command(name="verify")
-async def verify(ctx):
-    """Get Netflix verification PIN code"""
-    user_id = ctx.author.id
-    user_name = ctx.author.name
-    channel_id = ctx.channel.id
+class NetflixBot(commands.Bot):
+    """Bot subclass wiring the Netflix cog into the startup lifecycle"""
 
-    logger.info(
-        f"Verify command triggered by user {user_id} ({user_name}) in channel {channel_id}"
-    )
+    async def setup_hook(self):
+        await self.add_cog(NetflixCog(self))
 
-    try:
-        if is_rate_limited(user_id):
-            logger.warning(f"User {user_id} ({user_name}) hit rate limit")
-            await ctx.send("⚠️ Rate limit exceeded. Please wait before trying again.")
-            return
 
-        await ctx.send("🔍 Searching for Netflix verification email...")
+bot = NetflixBot(command_prefix="!", intents=discord.Intents.all())
 
-        challenge_code = await access_verify_link()
 
-        if challenge_code:
-            logger.info(
-                f"Successfully retrieved challenge code for user {user_id}: {challenge_code}"
-            )
-            await ctx.send(f"✅ Challenge code: **{challenge_code}**")
-        else:
-            logger.warning(f"Failed to retrieve challenge code for user {user_id}")
-            await ctx.send(
-                "❌ Failed to get the challenge code. Please ensure you've requested a PIN from Netflix first."
-            )
-
-    except Exception as e:
-        logger.error(f"Error in verify command for user {user_id}: {e}")
-        await ctx.send("❌ An error occurred while processing your request.")
+@bot.event
+async def on_ready():
+    logger.info(f"Logged in as {bot.user}")
+    logger.info(f"Bot is ready to serve {len(bot.guilds)} guilds")
 
 
 @bot.event
@@ -640,7 +1184,6 @@ async def on_command_error(ctx, error):
 
 if __name__ == "__main__":
     logger.info("Starting Netflix Receive PIN Discord Bot")
-    # get_sign_in_code()  # Commented out as it's not needed for bot startup
 
     if not TOKEN:
         logger.error(